@@ -0,0 +1,193 @@
+"""Parse well-formed, fully-ordered ICSD CIFs without pymatgen's CifParser."""
+
+from __future__ import annotations
+
+import re
+
+import numpy as np
+
+from pymatgen.core import Element, Lattice, Species, Structure
+from pymatgen.core.operations import SymmOp
+
+_CELL_TAGS = (
+    "_cell_length_a",
+    "_cell_length_b",
+    "_cell_length_c",
+    "_cell_angle_alpha",
+    "_cell_angle_beta",
+    "_cell_angle_gamma",
+)
+_CELL_RES = {tag: re.compile(rf"^{tag}\s+(\S+)", re.MULTILINE) for tag in _CELL_TAGS}
+_DATA_BLOCK_RE = re.compile(r"^data_", re.MULTILINE)
+_TOKEN_RE = re.compile(r"'[^']*'|\"[^\"]*\"|\S+")
+_UNCERTAINTY_RE = re.compile(r"\(\d+\)$")
+_ELEMENT_RE = re.compile(r"^[A-Z][a-z]?")
+
+_SYMOP_TAGS = ("_space_group_symop_operation_xyz", "_symmetry_equiv_pos_as_xyz")
+
+# Same tolerances as pymatgen's CifParser defaults
+_FRAC_TOLERANCE = 1e-4
+_SITE_TOLERANCE = 1e-4
+_OCCUPANCY_TOLERANCE = 1e-4
+
+
+def _to_float(value: str) -> float:
+    """Convert a CIF number to a float, dropping any uncertainty."""
+    return float(_UNCERTAINTY_RE.sub("", value))
+
+
+def _parse_loops(cif_str: str) -> dict[str, list[str]]:
+    """Map each looped tag to its column of values.
+
+    Loops whose values cannot be split unambiguously into columns are
+    skipped. Text fields (semicolon-delimited) count as a single value.
+    """
+    columns: dict[str, list[str]] = {}
+    tags: list[str] = []
+    values: list[str] = []
+    in_loop = in_text = False
+
+    def _close_loop() -> None:
+        if tags and len(values) % len(tags) == 0:
+            for i, tag in enumerate(tags):
+                columns[tag] = values[i :: len(tags)]
+
+    for line in cif_str.splitlines():
+        if line.startswith(";"):
+            if in_text and in_loop:
+                values.append("?")
+            in_text = not in_text
+            continue
+        line = line.strip()
+        if in_text or not line or line.startswith("#"):
+            continue
+
+        if line == "loop_":
+            _close_loop()
+            tags, values, in_loop = [], [], True
+        elif in_loop and line.startswith("_") and not values:
+            tags.append(line.split()[0])
+        elif in_loop and not line.startswith(("_", "data_")):
+            values.extend(token.strip("'\"") for token in _TOKEN_RE.findall(line))
+        else:
+            if in_loop:
+                _close_loop()
+            tags, values, in_loop = [], [], False
+
+    if in_loop:
+        _close_loop()
+    return columns
+
+
+def _snap_fractions(coords: np.ndarray) -> np.ndarray:
+    """Replace truncated thirds, e.g. 0.3333, with their exact values."""
+    for frac in (1 / 3, 2 / 3):
+        coords[np.abs(coords - frac) < _FRAC_TOLERANCE] = frac
+    return coords
+
+
+def _unique_images(coords: np.ndarray) -> np.ndarray:
+    """Remove symmetry images which coincide under periodic boundaries."""
+    diff = coords[:, None, :] - coords[None, :, :]
+    diff -= np.round(diff)
+    close = np.all(np.abs(diff) < _SITE_TOLERANCE, axis=-1)
+    keep = [i for i in range(len(coords)) if not close[i, :i].any()]
+    return coords[keep]
+
+
+def _parse_clean_cif(cif_str: str) -> Structure | None:
+    if len(_DATA_BLOCK_RE.findall(cif_str)) != 1:
+        return None
+
+    cell = []
+    for tag in _CELL_TAGS:
+        if (match := _CELL_RES[tag].search(cif_str)) is None:
+            return None
+        cell.append(_to_float(match.group(1)))
+
+    loops = _parse_loops(cif_str)
+    if (
+        symops := next((loops[tag] for tag in _SYMOP_TAGS if tag in loops), None)
+    ) is None:
+        return None
+    ops = [SymmOp.from_xyz_str(op) for op in symops]
+    rotations = np.array([op.rotation_matrix for op in ops])
+    translations = np.array([op.translation_vector for op in ops])
+
+    oxi_states = {
+        symbol: _to_float(oxi)
+        for symbol, oxi in zip(
+            loops.get("_atom_type_symbol", []),
+            loops.get("_atom_type_oxidation_number", []),
+        )
+    }
+
+    type_symbols = loops["_atom_site_type_symbol"]
+    frac_coords = _snap_fractions(
+        np.array(
+            [
+                [_to_float(v) for v in loops[f"_atom_site_fract_{axis}"]]
+                for axis in "xyz"
+            ],
+            dtype=np.float64,
+        ).T
+    )
+    num_sites = len(type_symbols)
+    occupancies = loops.get("_atom_site_occupancy", ["1"] * num_sites)
+    multiplicities = loops.get("_atom_site_symmetry_multiplicity", [None] * num_sites)
+    if not (num_sites == len(frac_coords) == len(occupancies) == len(multiplicities)):
+        return None
+
+    species: list[Element | Species] = []
+    coords: list[np.ndarray] = []
+    for type_symbol, site_coords, occupancy, multiplicity in zip(
+        type_symbols, frac_coords, occupancies, multiplicities
+    ):
+        # Partial occupancies need CifParser's disorder handling
+        if abs(_to_float(occupancy) - 1.0) > _OCCUPANCY_TOLERANCE:
+            return None
+        if (match := _ELEMENT_RE.match(type_symbol)) is None:
+            return None
+        element = Element(match.group(0))
+
+        images = _unique_images(
+            (np.einsum("ijk,k->ij", rotations, site_coords) + translations) % 1.0
+        )
+        if multiplicity is not None and len(images) != int(multiplicity):
+            return None
+
+        site_species = (
+            Species(element.symbol, oxi_states[type_symbol])
+            if type_symbol in oxi_states
+            else element
+        )
+        species.extend([site_species] * len(images))
+        coords.append(images)
+
+    all_coords = np.concatenate(coords)
+    # Symmetry-distinct sites should never coincide in an ordered structure
+    if len(_unique_images(all_coords)) != len(all_coords):
+        return None
+
+    structure = Structure(Lattice.from_parameters(*cell), species, all_coords)
+    return (
+        structure.get_sorted_structure()
+        .get_primitive_structure()
+        .get_reduced_structure()
+    )
+
+
+def parse_clean_cif(cif_str: str) -> Structure | None:
+    """Parse a single-block, fully-ordered CIF directly into its primitive structure.
+
+    This reads only the cell parameters, symmetry operations, atom types,
+    and atom sites, and mirrors what `CifParser.parse_structures(primitive=True)`
+    produces from them. None is returned for any CIF which needs the full
+    parser: missing or malformed tags, partial occupancies, multiple data
+    blocks, overlapping sites, or sites whose symmetry images disagree
+    with their stated multiplicity.
+    """
+    try:
+        return _parse_clean_cif(cif_str)
+    except (KeyError, ValueError, IndexError):
+        return None
@@ -1,20 +1,27 @@
 from __future__ import annotations
 
-from contextlib import redirect_stderr, redirect_stdout
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, redirect_stderr, redirect_stdout
+import ctypes
 from io import StringIO
-import json
+import os
 from string import printable
-from tempfile import NamedTemporaryFile
+import sys
+from tempfile import NamedTemporaryFile, TemporaryFile
 from typing import TYPE_CHECKING
 
 from pathlib import Path
+import orjson
 from pydantic import BaseModel, field_serializer, model_validator, ConfigDict
 
 from pymatgen.core import Composition, Structure
+from pymatgen.core.units import Length, Mass
 from pymatgen.io.cif import CifParser
 
-from xtalxd.icsd.client.client.enums import IcsdSubset
-from xtalxd.icsd.client.client.schemas import IcsdPropertyDoc
+from xtalxd.analysis.fast_cif import parse_clean_cif
+from xtalxd.icsd.enums import IcsdSubset
+from xtalxd.icsd.schemas import IcsdPropertyDoc
 
 from pycodcif.pycodcif import CifFile, cif_print
 
@@ -24,6 +31,26 @@ if TYPE_CHECKING:
 
 ASCII_CHARS = set(printable)
 
+# Removes the ASCII control characters not in ASCII_CHARS
+_NON_PRINTABLE_TABLE = str.maketrans(
+    "", "", "".join(chr(c) for c in range(128) if chr(c) not in ASCII_CHARS)
+)
+
+# Match json.dumps in accepting NumPy values and non-string keys
+_ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+# Converts a density in amu / cubic angstrom to g / cm^3, as in Structure.density
+_DENSITY_CONVERSION = float(Mass(1, "amu").to("g") / Length(1, "ang").to("cm") ** 3)
+
+# pycodcif only reads from files, use a memory-backed filesystem if present
+_TMP_CIF_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+# Flushes the C stdio buffers, which pycodcif prints to
+try:
+    _LIBC = ctypes.CDLL(None)
+except (OSError, TypeError):
+    _LIBC = None
+
 DEFAULT_COD_CIF_OPTIONS = {
     k: 1
     for k in (
@@ -42,40 +69,88 @@ DEFAULT_COD_CIF_OPTIONS = {
 }
 
 
+def _flush_std_streams() -> None:
+    for stream in (sys.stdout, sys.stderr, sys.__stdout__, sys.__stderr__):
+        if stream is not None:
+            stream.flush()
+    if _LIBC is not None:
+        _LIBC.fflush(None)
+
+
+def _capture_fd_output(func, *args) -> tuple[str, str]:
+    """Call `func`, and return what it wrote to file descriptors 1 and 2.
+
+    C extensions write to these directly, which redirect_stdout and
+    redirect_stderr do not capture. The descriptors are shared by the
+    whole process, so this should not be used from several threads.
+    """
+    with (
+        TemporaryFile(dir=_TMP_CIF_DIR) as out,
+        TemporaryFile(dir=_TMP_CIF_DIR) as err,
+    ):
+        _flush_std_streams()
+        saved_fds = (os.dup(1), os.dup(2))
+        try:
+            os.dup2(out.fileno(), 1)
+            os.dup2(err.fileno(), 2)
+            func(*args)
+        finally:
+            _flush_std_streams()
+            for fd, saved_fd in zip((1, 2), saved_fds):
+                os.dup2(saved_fd, fd)
+                os.close(saved_fd)
+
+        out.seek(0)
+        err.seek(0)
+        return (
+            out.read().decode(errors="replace"),
+            err.read().decode(errors="replace"),
+        )
+
+
 def _pycodcif_to_pymatgen_from_file(
     file_name: str | Path,
-) -> list[Structure]:
+) -> tuple[str, str, CifFile]:
 
     cif_obj = CifFile(file_name, DEFAULT_COD_CIF_OPTIONS)
+    stdout_text, stderr_text = _capture_fd_output(cif_print, cif_obj._cif)
+    return stdout_text, stderr_text, cif_obj
 
-    stdout = StringIO()
-    stderr = StringIO()
-    with redirect_stdout(stdout), redirect_stderr(stderr):
-        cif_print(cif_obj._cif)
-        stdout_text = stdout.read()
-        stderr_text = stderr.read()
 
-    return stdout_text, stderr_text, cif_obj
+@contextmanager
+def _temp_cif_file(cif_str: str) -> Iterator[str]:
+    """Write a CIF to a temporary file, and yield its name."""
+    with NamedTemporaryFile(
+        mode="w", suffix=".cif", dir=_TMP_CIF_DIR, encoding="ascii", delete=False
+    ) as f:
+        # remove non-ASCII and non-printable characters
+        f.write(
+            cif_str.encode("ascii", errors="ignore")
+            .decode("ascii")
+            .translate(_NON_PRINTABLE_TABLE)
+        )
+
+    try:
+        yield f.name
+    finally:
+        os.remove(f.name)
 
 
 def _pycodcif_to_pymatgen_from_str(
     cif_str: str,
-) -> list[Structure]:
-    temp_file = NamedTemporaryFile(suffix=".cif")
-    with open(temp_file.name, "w", encoding="utf-8") as f:
-        # remove non-ASCII characters
-        f.write(cif_str)
-        f.seek(0)
+) -> tuple[str, str, CifFile]:
+    with _temp_cif_file(cif_str) as file_name:
+        return _pycodcif_to_pymatgen_from_file(file_name)
 
-    output = _pycodcif_to_pymatgen_from_file(temp_file.name)
-    temp_file.close()
-    return output
 
+def get_chemsys_from_composition(composition: Composition) -> list[str]:
+    # Species of the same element share a symbol, no need to remove charges
+    return sorted({species.symbol for species in composition.elements})
 
-def get_chemsys_from_structure(structure: Structure):
-    return sorted(
-        set([element for element in structure.composition.remove_charges().as_dict()])
-    )
+
+def get_chemsys_from_structure(structure: Structure) -> list[str]:
+    # A single pass over the sites, without building a Composition
+    return sorted({species.symbol for site in structure for species in site.species})
 
 
 # def _pycodcif_to_pymatgen_from_file(
@@ -106,21 +181,86 @@ def get_chemsys_from_structure(structure: Structure):
 #     return structures
 
 
-def _pycodcif_to_pymatgen(
-    cif_str: str, cif_parser: CifParser | None = None
-) -> list[Structure]:
-
-    temp_file = NamedTemporaryFile(suffix=".cif")
-    with open(temp_file.name, "w", encoding="utf-8") as f:
-        # remove non-ASCII characters
-        f.write("".join(filter(lambda x: x in ASCII_CHARS, cif_str)))
-        f.seek(0)
+def _pycodcif_to_pymatgen(cif_str: str) -> Structure:
+    """Parse the first structure in a CIF as cleaned up by pycodcif."""
+    cif_text, _, _ = _pycodcif_to_pymatgen_from_str(cif_str)
+    if not cif_text.strip():
+        raise ValueError("pycodcif: no output")
+    return CifParser.from_str(cif_text).parse_structures(primitive=True)[0]
 
-    structures = _pycodcif_to_pymatgen_from_file(temp_file.name, cif_parser=cif_parser)
 
-    temp_file.close()
+def _parse_structure(
+    cif_str: str, parser: CifParser, fast_cif: bool, remarks: list[str]
+) -> Structure | None:
+    """Parse the first structure in a CIF, falling back to pycodcif.
 
-    return structures
+    Parsing errors are added to `remarks`, and None is returned if
+    no parser succeeds.
+    """
+    if fast_cif:
+        # Anything the fast parser cannot handle is left to CifParser
+        try:
+            if (structure := parse_clean_cif(cif_str)) is not None:
+                return structure
+        except Exception:
+            pass
+
+    try:
+        return parser.parse_structures(primitive=True)[0]
+    except Exception as exc_pmg:
+        remarks.append(str(exc_pmg))
+
+    try:
+        return _pycodcif_to_pymatgen(cif_str)
+    except Exception as exc_pycodcif:
+        remarks.append(str(exc_pycodcif))
+    return None
+
+
+def _is_ordered(structure: Structure) -> bool:
+    # Some ICSD structures are disordered only in manually assigned oxidation states
+    if structure.is_ordered:
+        return True
+    if any(
+        getattr(species, "oxi_state", None) is not None
+        for site in structure
+        for species in site.species
+    ):
+        try:
+            return structure.copy().remove_oxidation_states().is_ordered
+        except ValueError:
+            pass
+    return False
+
+
+def _get_structure_properties(
+    structure: Structure, remarks: list[str]
+) -> dict[str, Any]:
+    """Get the composition and per-site properties of a structure.
+
+    Errors in the chemical system or density are added to `remarks`.
+    """
+    # Structure.composition is rebuilt from the sites on every access
+    composition = structure.composition
+    volume = structure.lattice.volume
+
+    properties = {
+        "structure": structure,
+        "ions": [str(ele) for ele in composition],
+        "num_elements": len(composition.elements),
+        "composition": composition.as_dict(),
+        "num_sites": len(structure),
+        "volume_per_atom": volume / len(structure),
+        "is_ordered": _is_ordered(structure),
+    }
+
+    try:
+        properties["chemsys"] = "-".join(get_chemsys_from_composition(composition))
+        properties["density"] = float(composition.weight) / volume * _DENSITY_CONVERSION
+    except Exception as exc:
+        remarks.append(f"chemsys: {exc}")
+
+    return properties
 
 
 class IcsdStructureDoc(BaseModel):
@@ -153,7 +293,7 @@ class IcsdStructureDoc(BaseModel):
         if field is not None:
             if hasattr(field, "as_dict"):
                 field = field.as_dict()
-            return json.dumps(field)
+            return orjson.dumps(field, option=_ORJSON_OPTIONS).decode()
         return None
 
     @model_validator(mode="before")
@@ -161,79 +301,33 @@ class IcsdStructureDoc(BaseModel):
     def from_dct_obj(cls, config: Any) -> Any:
         for k in ("structure", "composition"):
             if isinstance(config.get(k), str):
-                config[k] = json.loads(config[k])
+                config[k] = orjson.loads(config[k])
         return config
 
     @classmethod
-    def from_cif_str(cls, cif_str: str, **kwargs) -> Self:
+    def from_cif_str(cls, cif_str: str, fast_cif: bool = True, **kwargs) -> Self:
+        """Parse a CIF and analyze the resulting structure.
+
+        If `fast_cif`, clean and fully-ordered CIFs are parsed with
+        `parse_clean_cif`, and all others with pymatgen's CifParser.
+        """
 
         config = {
             "remarks": [],
             **kwargs,
         }
-        with StringIO(initial_value=cif_str) as stream:
-            parser = CifParser(stream)
-
-        parse_fail = False
-        try:
-            with redirect_stderr(StringIO()), redirect_stdout(StringIO()):
-                structure = parser.parse_structures(primitive=True)[0]
-
-        except Exception as exc_pmg:
-
-            config["remarks"].append(str(exc_pmg))
-            try:
-
-                structure = _pycodcif_to_pymatgen(cif_str, cif_parser=parser)[0]
-            except Exception as exc_pycodcif:
-                config["remarks"].append(str(exc_pycodcif))
-                parse_fail = True
-
-        if parse_fail:
-            config["cif"] = cif_str
-            return cls(**config)
-
-        composition = Composition(structure.composition.as_dict())
-
-        # Some ICSD structures are disordered only in manually assigned oxidation states
-        if struct_is_disordered := not structure.is_ordered:
+        parser = CifParser.from_str(cif_str)
 
-            try:
-                if (
-                    Structure(
-                        structure.lattice,
-                        species=[site.species for site in structure],
-                        coords=structure.frac_coords,
-                        coords_are_cartesian=False,
-                        charge=structure.charge,
-                    )
-                    .remove_oxidation_states()
-                    .is_ordered
-                ):
-                    struct_is_disordered = False
-
-            except ValueError:
-                pass
-
-        config.update(
-            {
-                "structure": structure,
-                "ions": [str(ele) for ele in structure.composition],
-                "num_elements": len(composition.elements),
-                "composition": composition.as_dict(),
-                "num_sites": len(structure),
-                "volume_per_atom": structure.volume / len(structure),
-                "is_ordered": not struct_is_disordered,
-            }
-        )
+        # Discard anything printed while parsing and checking the structure
+        sink = StringIO()
+        with redirect_stderr(sink), redirect_stdout(sink):
+            structure = _parse_structure(cif_str, parser, fast_cif, config["remarks"])
+            if structure is None:
+                config["cif"] = cif_str
+                return cls(**config)
 
-        try:
-            config["chemsys"] = "-".join(get_chemsys_from_structure(structure))
-            config["density"] = structure.density
-        except Exception as exc:
-            config["remarks"].append(f"chemsys: {exc}")
+            config.update(_get_structure_properties(structure, config["remarks"]))
 
-        with redirect_stderr(StringIO()), redirect_stdout(StringIO()):
             try:
                 remarks = parser.check(structure)
             except Exception as exc:
@@ -251,7 +345,10 @@ class IcsdStructureDoc(BaseModel):
         if len(config["remarks"]) == 0:
             config["remarks"] = None
 
-        return cls(**config)
+        # Only the caller's fields need validation, the others were built above
+        return cls(**kwargs).model_copy(
+            update={k: v for k, v in config.items() if k not in kwargs}
+        )
 
     @classmethod
     def from_icsd_property_doc(cls, doc: IcsdPropertyDoc) -> Self:
@@ -262,3 +359,33 @@ class IcsdStructureDoc(BaseModel):
             icsd_id=doc.collection_code,
             subset=doc.subset,
         )
+
+    @classmethod
+    def from_cif_strs_parallel(
+        cls,
+        cif_strs: list[str],
+        kwargs: list[dict[str, Any]] | None = None,
+        workers: int | None = None,
+    ) -> list[Self]:
+        """Parse many CIFs with `from_cif_str` across a pool of processes.
+
+        Parsing is CPU-bound, so the work is split over `workers` processes
+        (defaults to the number of CPUs). `kwargs`, if specified, holds the
+        keyword arguments to pass to `from_cif_str` for each CIF.
+        """
+        workers = workers or os.cpu_count() or 1
+        kwargs = kwargs or [{} for _ in cif_strs]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            docs = executor.map(
+                _parse_cif_str,
+                zip(cif_strs, kwargs),
+                chunksize=max(1, len(cif_strs) // (workers * 4)),
+            )
+            return [cls(**doc) for doc in docs]
+
+
+def _parse_cif_str(args: tuple[str, dict[str, Any]]) -> dict[str, Any]:
+    # Return a serialized document, which is cheaper to send
+    # between processes than a pymatgen Structure
+    cif_str, kwargs = args
+    return IcsdStructureDoc.from_cif_str(cif_str, **kwargs).model_dump()
@@ -1,10 +1,14 @@
 from __future__ import annotations
 
+from collections import defaultdict
+from functools import partial
+from itertools import chain
+import os
 from pathlib import Path
 from typing import TYPE_CHECKING
-import json
 
 import multiprocessing
+import orjson
 import pandas as pd
 
 from pymatgen.analysis.structure_matcher import StructureMatcher, ElementComparator
@@ -12,21 +16,39 @@ from pymatgen.analysis.structure_matcher import StructureMatcher, ElementCompara
 from xtalxd.analysis.schemas import IcsdStructureDoc
 
 if TYPE_CHECKING:
+    from typing import Any
+
     from pymatgen.core import Structure
 
 
 def aggregate_logs(cache_dir: str | Path) -> dict[str, list[list[int]]]:
     processed_chemsys = {}
     for p in Path(cache_dir).glob("*jsonl"):
-        with open(p, "r") as f:
+        with open(p, "rb") as f:
             for line in f:
-                processed_chemsys.update(json.loads(line))
+                processed_chemsys |= orjson.loads(line)
     return processed_chemsys
 
 
+def _structure_fingerprint(structure: Structure) -> tuple:
+    """A cheap key which is the same for any two identical structures."""
+    return (
+        structure.formula,
+        len(structure),
+        tuple(round(param, 4) for param in structure.lattice.parameters),
+    )
+
+
+def _doc_from_row(row: dict[str, Any]) -> IcsdStructureDoc | None:
+    try:
+        return IcsdStructureDoc(**row)
+    except Exception:
+        return None
+
+
 class StructureGrouper:
 
-    __slots__ = ("structure_matcher", "max_structure_size", "nproc", "cache_dir")
+    __slots__ = ("_structure_matcher", "max_structure_size", "nproc", "cache_dir")
 
     def __init__(
         self,
@@ -36,11 +58,7 @@ class StructureGrouper:
         cache_dir: str | Path | None = None,
     ) -> None:
 
-        self.structure_matcher = structure_matcher or StructureMatcher(
-            primitive_cell=True,
-            attempt_supercell=True,
-            comparator=ElementComparator(),
-        )
+        self._structure_matcher = structure_matcher
 
         self.max_structure_size = max_structure_size
         self.nproc = nproc
@@ -50,32 +68,73 @@ class StructureGrouper:
             if not self.cache_dir.exists():
                 self.cache_dir.mkdir(exist_ok=True, parents=True)
 
+    @property
+    def structure_matcher(self) -> StructureMatcher:
+        # The default matcher is only built when it is first used
+        if self._structure_matcher is None:
+            self._structure_matcher = StructureMatcher(
+                primitive_cell=True,
+                attempt_supercell=True,
+                comparator=ElementComparator(),
+            )
+        return self._structure_matcher
+
+    @structure_matcher.setter
+    def structure_matcher(self, structure_matcher: StructureMatcher) -> None:
+        self._structure_matcher = structure_matcher
+
     def _group_structures(
         self,
-        structures: dict[str, list[Structure]],
-        structure_groups: list[int],
-        cache_file: str | Path | None = None,
-    ) -> None:
-
-        for cs, struct_in_cs in structures.items():
-            groups = self.structure_matcher.group_structures(struct_in_cs)
-            icsd_groups = [
-                sorted([structure._icsd_id for structure in group]) for group in groups
-            ]
+        chemsys_structures: tuple[str, list[Structure]],
+    ) -> list[list[int]]:
+
+        cs, struct_in_cs = chemsys_structures
+
+        # Identical structures always end up in the same group,
+        # so only pass one copy of each to the structure matcher
+        unique_structs: list[Structure] = []
+        by_fingerprint: dict[tuple, list[Structure]] = defaultdict(list)
+        duplicate_ids: dict[int, list[int]] = defaultdict(list)
+        for structure in struct_in_cs:
+            candidates = by_fingerprint[_structure_fingerprint(structure)]
+            for other in candidates:
+                if other == structure:
+                    duplicate_ids[id(other)].append(structure._icsd_id)
+                    break
+            else:
+                candidates.append(structure)
+                unique_structs.append(structure)
+
+        groups = self.structure_matcher.group_structures(unique_structs)
+        icsd_groups = [
+            sorted(
+                icsd_id
+                for structure in group
+                for icsd_id in (structure._icsd_id, *duplicate_ids[id(structure)])
+            )
+            for group in groups
+        ]
 
-            structure_groups.extend(icsd_groups)
+        if self.cache_dir:
+            # One file per worker process, so that no two processes share a file
+            with open(self.cache_dir / f"{os.getpid()}.jsonl", "ab") as f:
+                f.write(orjson.dumps({cs: icsd_groups}) + b"\n")
 
-            if cache_file:
-                with open(cache_file, "a") as f:
-                    f.write(json.dumps({cs: icsd_groups}) + "\n")
+        return icsd_groups
 
     def group_structures(
         self,
         structure_docs: list[IcsdStructureDoc],
     ) -> list[IcsdStructureDoc]:
+        return self._group_docs(structure_docs, self.nproc)
 
-        chemsys = set([doc.chemsys for doc in structure_docs])
-        by_chemsys = {cs: [] for cs in chemsys}
+    def _group_docs(
+        self,
+        structure_docs: list[IcsdStructureDoc],
+        nproc: int,
+    ) -> list[IcsdStructureDoc]:
+
+        by_chemsys: dict[str, list[Structure]] = defaultdict(list)
 
         unique_idx: list[int] = []
         for doc in structure_docs:
@@ -87,61 +146,71 @@ class StructureGrouper:
             struct._icsd_id = doc.icsd_id
             by_chemsys[doc.chemsys].append(struct)
 
-        for cs in chemsys:
+        for cs in list(by_chemsys):
             if len(by_chemsys[cs]) == 1:
                 struct = by_chemsys.pop(cs)[0]
                 unique_idx.append([struct._icsd_id])
 
-        sorted_chemsys = sorted(by_chemsys, key=lambda k: len(by_chemsys[k]))
-        process_targets = [{} for _ in range(self.nproc)]
-        for iproc, cs in enumerate(sorted_chemsys):
-            process_targets[iproc % self.nproc][cs] = by_chemsys[cs]
-
-        manager = multiprocessing.Manager()
-        grouped_ids = manager.list(unique_idx)
-
-        procs = []
-        for iproc in range(self.nproc):
-
-            proc_kwargs = {}
-            if self.cache_dir:
-                proc_kwargs["cache_file"] = self.cache_dir / f"{iproc}.jsonl"
-
-            proc = multiprocessing.Process(
-                target=self._group_structures,
-                args=(
-                    process_targets[iproc],
-                    grouped_ids,
-                ),
-                kwargs=proc_kwargs,
-            )
-
-            proc.start()
-            procs.append(proc)
+        # Each chemsys is a separate task. The pool hands them out as workers
+        # free up, so start with the largest to avoid one long task at the end.
+        process_targets = sorted(
+            by_chemsys.items(), key=lambda item: len(item[1]), reverse=True
+        )
 
-        for proc in procs:
-            proc.join()
+        grouped_ids = unique_idx
+        if nproc > 1:
+            with multiprocessing.Pool(nproc) as pool:
+                for icsd_groups in pool.imap_unordered(
+                    self._group_structures, process_targets
+                ):
+                    grouped_ids.extend(icsd_groups)
+        else:
+            for icsd_groups in map(self._group_structures, process_targets):
+                grouped_ids.extend(icsd_groups)
 
         unique_docs = []
         docs_by_icsd_id = {doc.icsd_id: doc for doc in structure_docs}
-        for id_group in list(grouped_ids):
+        for id_group in grouped_ids:
             min_idx = id_group[0]
-            doc = docs_by_icsd_id[min_idx].model_dump()
-            doc["matched_icsd_ids"] = id_group
-            unique_docs.append(IcsdStructureDoc(**doc))
+            unique_docs.append(
+                docs_by_icsd_id[min_idx].model_copy(
+                    update={"matched_icsd_ids": id_group}
+                )
+            )
 
         return unique_docs
 
+    def _group_rows(
+        self, rows: list[dict[str, Any]], **kwargs
+    ) -> list[IcsdStructureDoc]:
+        """Build the documents for one chemical system's rows, and group them.
+
+        Each row's structure is only deserialized in the process which
+        groups it, and only the unique documents are sent back.
+        """
+        docs = [doc for doc in map(_doc_from_row, rows) if doc is not None]
+        return self._group_docs(docs, 1, **kwargs)
+
     def group_structures_from_dataframe(
         self, dataframe: pd.DataFrame, **kwargs
     ) -> list[IcsdStructureDoc]:
 
-        icsd_docs = []
-        for idx in dataframe.index:
-            try:
-                doc = IcsdStructureDoc(**dataframe.loc[idx])
-                icsd_docs.append(doc)
-            except Exception:
-                continue
-
-        return self.group_structures(icsd_docs, **kwargs)
+        # Structures are only grouped within a chemical system, so
+        # each chemical system's rows can be parsed and grouped together
+        columns = list(dataframe.columns)
+        rows_by_chemsys: dict[str | None, list[dict[str, Any]]] = defaultdict(list)
+        for values in dataframe.itertuples(index=False, name=None):
+            row = dict(zip(columns, values))
+            rows_by_chemsys[row.get("chemsys")].append(row)
+
+        # Start with the largest chemical systems, as in `group_structures`
+        process_targets = sorted(rows_by_chemsys.values(), key=len, reverse=True)
+        group_rows = partial(self._group_rows, **kwargs)
+        if self.nproc > 1:
+            with multiprocessing.Pool(self.nproc) as pool:
+                return list(
+                    chain.from_iterable(
+                        pool.imap_unordered(group_rows, process_targets)
+                    )
+                )
+        return list(chain.from_iterable(map(group_rows, process_targets)))
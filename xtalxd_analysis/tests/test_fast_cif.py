@@ -0,0 +1,132 @@
+import pytest
+from pymatgen.analysis.structure_matcher import StructureMatcher
+from pymatgen.io.cif import CifParser
+
+from xtalxd.analysis.fast_cif import parse_clean_cif
+
+CSCL_CIF = """data_CsCl
+_cell_length_a 4.123
+_cell_length_b 4.123
+_cell_length_c 4.123
+_cell_angle_alpha 90
+_cell_angle_beta 90
+_cell_angle_gamma 90
+loop_
+_space_group_symop_operation_xyz
+'x, y, z'
+loop_
+_atom_site_label
+_atom_site_type_symbol
+_atom_site_fract_x
+_atom_site_fract_y
+_atom_site_fract_z
+_atom_site_occupancy
+Cs1 Cs 0 0 0 1
+Cl1 Cl 0.5 0.5 0.5 1
+"""
+
+MGO_CIF_UNCERTAINTIES = """data_MgO
+_cell_length_a 4.2112(2)
+_cell_length_b 4.2112(2)
+_cell_length_c 4.2112(2)
+_cell_angle_alpha 90.
+_cell_angle_beta 90.
+_cell_angle_gamma 90.
+loop_
+_symmetry_equiv_pos_as_xyz
+'x, y, z'
+'x, y+1/2, z+1/2'
+'x+1/2, y, z+1/2'
+'x+1/2, y+1/2, z'
+loop_
+_atom_site_label
+_atom_site_type_symbol
+_atom_site_fract_x
+_atom_site_fract_y
+_atom_site_fract_z
+_atom_site_occupancy
+Mg1 Mg 0 0 0 1.
+O1 O 0.5000(1) 0.5000(1) 0.5000(1) 1.000(2)
+"""
+
+TIO2_CIF_SYMOPS = """data_TiO2
+_cell_length_a 4.5937(3)
+_cell_length_b 4.5937(3)
+_cell_length_c 2.9587(2)
+_cell_angle_alpha 90.
+_cell_angle_beta 90.
+_cell_angle_gamma 90.
+loop_
+_space_group_symop_id
+_space_group_symop_operation_xyz
+1 'x, y, z'
+2 '-x, -y, z'
+3 '-y+1/2, x+1/2, z+1/2'
+4 'y+1/2, -x+1/2, z+1/2'
+5 '-x+1/2, y+1/2, -z+1/2'
+6 'x+1/2, -y+1/2, -z+1/2'
+7 'y, x, -z'
+8 '-y, -x, -z'
+9 '-x, -y, -z'
+10 'x, y, -z'
+11 'y+1/2, -x+1/2, -z+1/2'
+12 '-y+1/2, x+1/2, -z+1/2'
+13 'x+1/2, -y+1/2, z+1/2'
+14 '-x+1/2, y+1/2, z+1/2'
+15 '-y, -x, z'
+16 'y, x, z'
+loop_
+_atom_type_symbol
+_atom_type_oxidation_number
+Ti4+ 4
+O2- -2
+loop_
+_atom_site_label
+_atom_site_type_symbol
+_atom_site_symmetry_multiplicity
+_atom_site_fract_x
+_atom_site_fract_y
+_atom_site_fract_z
+_atom_site_occupancy
+Ti1 Ti4+ 2 0 0 0 1.
+O1 O2- 4 0.3048(1) 0.3048(1) 0 1.
+"""
+
+CUAU_CIF_PARTIAL_OCCUPANCY = """data_CuAu
+_cell_length_a 3.8
+_cell_length_b 3.8
+_cell_length_c 3.8
+_cell_angle_alpha 90
+_cell_angle_beta 90
+_cell_angle_gamma 90
+loop_
+_space_group_symop_operation_xyz
+'x, y, z'
+loop_
+_atom_site_label
+_atom_site_type_symbol
+_atom_site_fract_x
+_atom_site_fract_y
+_atom_site_fract_z
+_atom_site_occupancy
+Cu1 Cu 0 0 0 0.5
+Au1 Au 0 0 0 0.5
+"""
+
+
+@pytest.mark.parametrize(
+    "cif_str",
+    [CSCL_CIF, MGO_CIF_UNCERTAINTIES, TIO2_CIF_SYMOPS],
+    ids=["plain", "uncertainties", "symops"],
+)
+def test_parse_clean_cif_matches_cif_parser(cif_str):
+    structure = parse_clean_cif(cif_str)
+    assert structure is not None
+
+    reference = CifParser.from_str(cif_str).parse_structures(primitive=True)[0]
+    assert len(structure) == len(reference)
+    assert StructureMatcher().fit(structure, reference)
+
+
+def test_parse_clean_cif_partial_occupancy():
+    assert parse_clean_cif(CUAU_CIF_PARTIAL_OCCUPANCY) is None
@@ -0,0 +1,51 @@
+import pytest
+from pymatgen.io.cif import CifParser
+
+from xtalxd.analysis import schemas
+from xtalxd.analysis.schemas import IcsdStructureDoc
+
+# CifParser finds no structures without the data block header,
+# which pycodcif adds back
+NACL_CIF_NO_HEADER = """_symmetry_space_group_name_H-M   'F m -3 m'
+_symmetry_Int_Tables_number   225
+_cell_length_a   5.64
+_cell_length_b   5.64
+_cell_length_c   5.64
+_cell_angle_alpha   90
+_cell_angle_beta   90
+_cell_angle_gamma   90
+loop_
+ _atom_site_label
+ _atom_site_type_symbol
+ _atom_site_fract_x
+ _atom_site_fract_y
+ _atom_site_fract_z
+ _atom_site_occupancy
+  Na1  Na+  0  0  0  1
+  Cl1  Cl-  0.5  0.5  0.5  1
+"""
+
+
+@pytest.mark.parametrize("fast_cif", [True, False])
+def test_pycodcif_fallback(fast_cif, capfd):
+    with pytest.raises(ValueError):
+        CifParser.from_str(NACL_CIF_NO_HEADER).parse_structures(primitive=True)
+
+    doc = IcsdStructureDoc.from_cif_str(NACL_CIF_NO_HEADER, fast_cif=fast_cif)
+    assert doc.structure is not None
+    assert doc.structure.reduced_formula == "NaCl"
+    assert doc.chemsys == "Cl-Na"
+
+    # The CIF printed by pycodcif is captured, not written to stdout
+    assert "_cell_length_a" not in capfd.readouterr().out
+
+
+def test_fast_cif_error_falls_back_to_cif_parser(monkeypatch):
+    def _raise(cif_str):
+        raise TypeError("fast_cif failed")
+
+    monkeypatch.setattr(schemas, "parse_clean_cif", _raise)
+    doc = IcsdStructureDoc.from_cif_str("data_NaCl\n" + NACL_CIF_NO_HEADER)
+    assert doc.structure is not None
+    assert doc.structure.reduced_formula == "NaCl"
+    assert not any("fast_cif failed" in remark for remark in doc.remarks)
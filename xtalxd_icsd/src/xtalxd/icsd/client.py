@@ -6,19 +6,26 @@ This module is based on
 
 from __future__ import annotations
 
+from concurrent.futures import ThreadPoolExecutor
+import csv
+from functools import partial
+from hashlib import blake2b
+from itertools import chain
 import os
+from pathlib import Path
 import re
 import requests
 from requests.adapters import HTTPAdapter
+from tempfile import NamedTemporaryFile
+from threading import Lock
 from time import time
 from typing import TYPE_CHECKING
 from urllib3.util.retry import Retry
+import weakref
 
 import logging
 
-import multiprocessing
-import numpy as np
-from pydantic import BaseModel, Field, PrivateAttr
+from pydantic import BaseModel, Field, PrivateAttr, TypeAdapter
 
 from xtalxd.icsd.settings import IcsdClientSettings
 from xtalxd.icsd.enums import (
@@ -38,6 +45,59 @@ _ICSD_TOKEN_TIMEOUT = 3600
 
 logger = logging.getLogger("xtalxd_icsd")
 
+# Each CIF returned by the ICSD starts with its copyright line
+_CIF_HEADER = b"#(C)"
+_ICSD_CODE_RE = re.compile(rb"_database_code_ICSD (\d+)")
+_IDNUMS_RE = re.compile(rb"<idnums>(.*?)</idnums>", re.DOTALL)
+
+# The ICSD selects CSV columns by field name, allow requesting them
+# by member, name, or value
+_FIELD_NAMES: dict[IcsdDataFields | str, str] = {
+    key: field.name
+    for field in IcsdDataFields
+    for key in (field, field.name, field.value)
+}
+
+
+def _get_field_names(properties: list[str | IcsdDataFields] | None) -> list[str]:
+    """Get the ICSD field names of properties, all of them by default."""
+    names = []
+    for prop in properties or list(IcsdDataFields):
+        if (name := _FIELD_NAMES.get(prop)) is None:
+            raise ValueError(f"Unknown ICSD property {prop!r}")
+        names.append(name)
+    return names
+
+
+# Search keywords can be passed by either name or value
+_SEARCH_KEYS: dict[str, str] = {
+    key: field.name.lower()
+    for field in IcsdAdvancedSearchKeys
+    for key in (field.name, field.value)
+}
+
+_DOC_LIST_ADAPTER = TypeAdapter(list[IcsdPropertyDoc])
+
+
+def _logout_via_token(auth_token: str, is_windows: bool) -> None:
+    """End an ICSD session which was not logged out explicitly.
+
+    This holds no reference to the session, so that it can be used
+    as a finalizer for it.
+    """
+    try:
+        requests.get(
+            "https://icsd.fiz-karlsruhe.de/ws/auth/logout",
+            headers={
+                "accept": "text/plain",
+                "ICSD-Auth-Token": auth_token,
+            },
+            params=[("windowsclient", is_windows)],
+            timeout=10,
+        )
+    except requests.RequestException:
+        pass
+
 
 class IcsdClient(BaseModel):
     """Query data via the ICSD API."""
@@ -50,33 +110,58 @@ class IcsdClient(BaseModel):
     max_batch_size: float | None = Field(SETTINGS.MAX_BATCH_SIZE)
 
     use_document_model: bool = Field(True)
+    trust_server: bool = Field(False)
     num_parallel_requests: int | None = Field(None)
+    cache_dir: Path | None = Field(SETTINGS.CACHE_DIR)
 
     _auth_token: str | None = PrivateAttr(None)
     _session_start_time: float | None = PrivateAttr(None)
     _session: requests.Session | None = PrivateAttr(None)
+    _session_lock: Lock = PrivateAttr(default_factory=Lock)
+    _finalizer: weakref.finalize | None = PrivateAttr(None)
 
     @property
     def _is_windows(self) -> bool:
         return os.name == "nt"
 
-    def refresh_session(self, force: bool = False) -> None:
-        if self._session_start_time is None:
-            self._session_start_time = time()
-
-        if (
-            self._auth_token is None
-            or ((time() - self._session_start_time) > 0.98 * _ICSD_TOKEN_TIMEOUT)
-            or force
-        ):
-            if self._session:
-                self.logout()
-            self._session_start_time = time()
-            self.login()
+    def refresh_session(self, force: bool = False) -> requests.Session:
+        # The session is shared by all threads in `search`, only one
+        # of which should renew the auth token. Callers use the session
+        # returned here, so they never see it half way through renewal.
+        with self._session_lock:
+            if self._session_start_time is None:
+                self._session_start_time = time()
+
+            if (
+                self._auth_token is None
+                or ((time() - self._session_start_time) > 0.98 * _ICSD_TOKEN_TIMEOUT)
+                or force
+            ):
+                # Other threads may still be using the old session, its
+                # token is logged out by its finalizer once they are done
+                self._session_start_time = time()
+                self.login()
+            return self._session
 
     def login(self) -> None:
 
-        response = requests.post(
+        session = requests.Session()
+        pool_size = max(self.num_parallel_requests or 1, 10)
+        retry = Retry(
+            total=self.max_retries,
+            read=self.max_retries,
+            connect=self.max_retries,
+            respect_retry_after_header=True,
+            status_forcelist=[429, 504, 502],  # rate limiting
+            backoff_factor=0.1,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+
+        response = session.post(
             "https://icsd.fiz-karlsruhe.de/ws/auth/login",
             headers={
                 "accept": "text/plain",
@@ -87,50 +172,58 @@ class IcsdClient(BaseModel):
                 "password": self.password,
             },
         )
+        auth_token = None
         if response.status_code == 200:
-            self._auth_token = response.headers["ICSD-Auth-Token"]
-            if self._auth_token is None:
+            auth_token = response.headers["ICSD-Auth-Token"]
+            if auth_token is None:
                 logger.warning(
-                    f"{self.__module__}.{self.__class__.__name__} "
-                    f"failed to fetch auth token: {response.content}"
+                    "%s.%s failed to fetch auth token: %s",
+                    self.__module__,
+                    self.__class__.__name__,
+                    response.content,
                 )
         else:
             logger.warning(
-                f"{self.__module__}.{self.__class__.__name__} "
-                "failed to fetch auth token with status code "
-                f"{response.status_code}: {response.content}"
+                "%s.%s failed to fetch auth token with status code %s: %s",
+                self.__module__,
+                self.__class__.__name__,
+                response.status_code,
+                response.content,
             )
 
-        self._session = requests.Session()
-        self._session.headers = {"ICSD-Auth-Token": self._auth_token}
-        retry = Retry(
-            total=self.max_retries,
-            read=self.max_retries,
-            connect=self.max_retries,
-            respect_retry_after_header=True,
-            status_forcelist=[429, 504, 502],  # rate limiting
-            backoff_factor=0.1,
+        session.headers.update({"ICSD-Auth-Token": auth_token})
+        # Log out once the session is garbage collected or the
+        # interpreter exits without `logout` being called
+        self._finalizer = (
+            weakref.finalize(session, _logout_via_token, auth_token, self._is_windows)
+            if auth_token is not None
+            else None
         )
-        adapter = HTTPAdapter(max_retries=retry)
-        self._session.mount("http://", adapter)
-        self._session.mount("https://", adapter)
+        self._auth_token = auth_token
+        self._session = session
 
     def logout(self) -> None:
 
-        if not self._session:
+        with self._session_lock:
+            session, self._session = self._session, None
+            self._auth_token = None
+            self._session_start_time = None
+
+        if not session:
             return
 
-        _ = self._session.get(
+        if self._finalizer is not None:
+            self._finalizer.detach()
+            self._finalizer = None
+
+        _ = session.get(
             "https://icsd.fiz-karlsruhe.de/ws/auth/logout",
             headers={
                 "accept": "text/plain",
             },
             params=[("windowsclient", self._is_windows)],
         )
-        self._auth_token = None
-        self._session_start_time = None
-        self._session.close()
-        self._session = None
+        session.close()
 
     def __enter__(self) -> None:
         self.login()
@@ -139,121 +232,145 @@ class IcsdClient(BaseModel):
     def __exit__(self, *args) -> None:
         self.logout()
 
-    def __del__(self) -> None:
-        self.logout()
-
     def _get(self, *args, **kwargs) -> requests.Response:
-        self.refresh_session()
+        session = self.refresh_session()
         params = tuple(
             list(kwargs.pop("params", [])) + [("windowsclient", self._is_windows)]
         )
-        resp = self._session.get(*args, **kwargs, params=params)
-        if resp.status_code != 200:
+        resp = session.get(*args, **kwargs, params=params)
+        # Reading the content of a streamed response consumes it,
+        # only do so if the warning will be emitted
+        if resp.status_code != 200 and logger.isEnabledFor(logging.WARNING):
             logger.warning(
-                f"{self.__module__}.{self.__class__.__name__} "
-                "failed to fetch content with status code "
-                f"{resp.status_code}: {resp.content}"
+                "%s.%s failed to fetch content with status code %s: %s",
+                self.__module__,
+                self.__class__.__name__,
+                resp.status_code,
+                resp.content,
             )
         return resp
 
+    def _get_cache_file(self, *key) -> Path | None:
+        """Get the cache file for a response, if caching is enabled.
+
+        Files are keyed by a hash of the request, and sharded over
+        subdirectories to keep directory sizes manageable.
+        """
+        if self.cache_dir is None:
+            return None
+        digest = blake2b(repr(key).encode(), digest_size=16).hexdigest()
+        return Path(self.cache_dir).expanduser() / digest[:2] / digest
+
+    @staticmethod
+    def _write_cache_file(cache_file: Path, content: bytes) -> None:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        # Write then rename so that concurrent readers never see a partial file
+        with NamedTemporaryFile(dir=cache_file.parent, delete=False) as f:
+            f.write(content)
+        os.replace(f.name, cache_file)
+
     def _get_cifs(self, collection_codes: int | list[int]) -> dict[int, str]:
-        if isinstance(collection_codes, int) or len(collection_codes) == 1:
-            cif_str = self._get(
-                f"https://icsd.fiz-karlsruhe.de/ws/cif/{collection_codes[0]}",
-                headers={
-                    "accept": "application/cif",
-                },
-            ).content.decode()
+        if isinstance(collection_codes, int):
+            collection_codes = [collection_codes]
+
+        cache_file = self._get_cache_file("cif", sorted(map(str, collection_codes)))
+        if cache_file and cache_file.exists():
+            raw_cifs = cache_file.read_bytes()
         else:
-            cif_str = self._get(
-                "https://icsd.fiz-karlsruhe.de/ws/cif/multiple",
-                headers={
-                    "accept": "application/cif",
-                },
-                params=[("idnum", collection_codes)],
-            ).content.decode()
+            if len(collection_codes) == 1:
+                response = self._get(
+                    f"https://icsd.fiz-karlsruhe.de/ws/cif/{collection_codes[0]}",
+                    headers={
+                        "accept": "application/cif",
+                    },
+                )
+            else:
+                response = self._get(
+                    "https://icsd.fiz-karlsruhe.de/ws/cif/multiple",
+                    headers={
+                        "accept": "application/cif",
+                    },
+                    params=[("idnum", collection_codes)],
+                )
+            raw_cifs = response.content
+            if cache_file and response.status_code == 200:
+                self._write_cache_file(cache_file, raw_cifs)
 
         return {
-            int(re.search(r"_database_code_ICSD ([0-9]+)", cif_body).group(1)): "#(C)"
-            + cif_body
-            for cif_body in cif_str.split("\n#(C)")[1:]
+            int(_ICSD_CODE_RE.search(cif_body).group(1)): (
+                _CIF_HEADER + cif_body
+            ).decode()
+            for cif_body in raw_cifs.split(b"\n" + _CIF_HEADER)[1:]
         }
 
+    def _batch_indices(self, indices: list[str]) -> list[list[str]]:
+        if not indices:
+            return []
+        if not self.max_batch_size or len(indices) <= self.max_batch_size:
+            return [indices]
+        batch_size = int(self.max_batch_size)
+        return [indices[i : i + batch_size] for i in range(0, len(indices), batch_size)]
+
     def _search(
         self,
         indices: list[int],
         properties: list[str | IcsdDataFields] | None = None,
         include_cif: bool = False,
         include_metadata: bool = False,
-        _data: list | None = None,
     ) -> list[dict[str, Any]]:
 
-        self.refresh_session(force=True)
-        search_props = [
-            (
-                prop.value
-                if isinstance(prop, IcsdDataFields)
-                else IcsdDataFields(prop).value
-            )
-            for prop in (properties or list(IcsdDataFields))
-        ]
-
-        if len(indices) > self.max_batch_size:
-            batched_ids: list[list[str]] = [
-                v.tolist()
-                for v in np.array_split(
-                    indices, np.ceil(len(indices) / self.max_batch_size)
-                )
-            ]
-
-            data = []
-            for i, batch in enumerate(batched_ids):
-                data.extend(
-                    self._search(
-                        batch,
-                        properties=search_props,
-                        include_cif=include_cif,
-                        include_metadata=include_metadata,
-                        _data=_data,
-                    )
-                )
-            return data
+        self.refresh_session()
+        search_props = _get_field_names(properties)
 
         if not include_cif and not include_metadata:
-            return [{"icsd_internal_id": int(idx) for idx in indices}]
+            return [{"icsd_internal_id": int(idx)} for idx in indices]
 
         if include_metadata:
             if "CollectionCode" not in search_props:
                 search_props.append("CollectionCode")
 
-            response = self._get(
-                "https://icsd.fiz-karlsruhe.de/ws/csv",
-                headers={
-                    "accept": "application/csv",
-                },
-                params=(
-                    ("idnum", tuple(indices)),
-                    ("listSelection", search_props),
-                ),
+            csv_lines = None
+            cache_file = self._get_cache_file(
+                "csv", sorted(map(str, indices)), search_props
             )
-
-            data = []
-            if response.status_code == 200:
-                csv_data = [
-                    row.split("\t") for row in response.content.decode().splitlines()
-                ]
-                columns = csv_data[0][:-1]
-
-                data += [
-                    {IcsdDataFields[k].value: row[i] for i, k in enumerate(columns)}
-                    for row in csv_data[1:]
-                ]
+            if cache_file and cache_file.exists():
+                csv_lines = cache_file.read_bytes().decode("utf-8").splitlines()
             else:
-                logger.warning(
-                    f"{self.__module__}.{self.__class__.__name__} "
-                    "csv search failed with status code "
-                    f"{response.status_code}: {response.content}"
+                response = self._get(
+                    "https://icsd.fiz-karlsruhe.de/ws/csv",
+                    headers={
+                        "accept": "application/csv",
+                    },
+                    params=(
+                        ("idnum", tuple(indices)),
+                        ("listSelection", search_props),
+                    ),
+                    stream=cache_file is None,
                 )
+                if response.status_code == 200:
+                    # The ICSD does not declare a charset for CSV responses
+                    response.encoding = response.encoding or "utf-8"
+                    if cache_file:
+                        self._write_cache_file(cache_file, response.content)
+                        csv_lines = response.text.splitlines()
+                    else:
+                        csv_lines = response.iter_lines(decode_unicode=True)
+                elif logger.isEnabledFor(logging.WARNING):
+                    logger.warning(
+                        "%s.%s csv search failed with status code %s: %s",
+                        self.__module__,
+                        self.__class__.__name__,
+                        response.status_code,
+                        response.content,
+                    )
+
+            data = []
+            if csv_lines is not None:
+                # Fields are tab-delimited, quote characters are kept as-is
+                csv_rows = csv.reader(csv_lines, delimiter="\t", quoting=csv.QUOTE_NONE)
+                columns = [IcsdDataFields[k].value for k in next(csv_rows, [])[:-1]]
+
+                data += [dict(zip(columns, row)) for row in csv_rows if row]
 
         if include_cif:
             cifs = self._get_cifs(indices)
@@ -263,8 +380,6 @@ class IcsdClient(BaseModel):
             else:
                 data = [{"collection_code": cc, "cif": cif} for cc, cif in cifs.items()]
 
-        if _data:
-            _data.extend(data)
         return data
 
     def search(
@@ -276,21 +391,25 @@ class IcsdClient(BaseModel):
         **kwargs,
     ) -> list:
 
+        # Fail on unknown properties before sending any requests,
+        # rather than in the threads searching each batch
+        properties = _get_field_names(properties)
+
         query_vars = []
-        for k in IcsdAdvancedSearchKeys:
-            if (v := kwargs.get(k.value)) is not None or (
-                v := kwargs.get(k.name) is not None
-            ):
-                if isinstance(v, tuple):
-                    v = f"{v[0]}-{v[1]}"
-                elif isinstance(v, list):
-                    v = ",".join(v)
-                query_vars.append(f"{k.name.lower()} : {v}")
+        for key, v in kwargs.items():
+            if (query_key := _SEARCH_KEYS.get(key)) is None or v is None:
+                continue
+            if isinstance(v, tuple):
+                v = f"{v[0]}-{v[1]}"
+            elif isinstance(v, list):
+                v = ",".join(v)
+            query_vars.append(f"{query_key} : {v}")
         query_str = " and ".join(query_vars)
 
         params = [("query", query_str)]
         if subset:
-            params.append(("content type", IcsdSubset(subset).name))
+            subset = IcsdSubset(subset)
+            params.append(("content type", subset.name))
 
         response = self._get(
             "https://icsd.fiz-karlsruhe.de/ws/search/expert",
@@ -301,43 +420,34 @@ class IcsdClient(BaseModel):
         )
 
         idxs: list[str] = []
-        if matches := re.match(".*<idnums>(.*)</idnums>.*", response.content.decode()):
-            idxs.extend(list(matches.groups())[0].split())
-
-        if self.num_parallel_requests and len(idxs) > self.num_parallel_requests:
-            batched_idxs = np.array_split(idxs, self.num_parallel_requests)
-
-            manager = multiprocessing.Manager()
-            procs = []
-            res = manager.list()
-            for iproc in range(self.num_parallel_requests):
-                proc = multiprocessing.Process(
-                    target=self._search,
-                    args=(batched_idxs[iproc].tolist(),),
-                    kwargs={
-                        "properties": properties,
-                        "include_cif": include_cif,
-                        "include_metadata": include_metadata,
-                        "_data": res,
-                    },
-                )
-                proc.start()
-                procs.append(proc)
+        if matches := _IDNUMS_RE.search(response.content):
+            idxs.extend(matches.group(1).decode().split())
 
-            for proc in procs:
-                proc.join()
-            return list(res)
-
-        data = self._search(
-            idxs,
+        _search = partial(
+            self._search,
             properties=properties,
             include_cif=include_cif,
             include_metadata=include_metadata,
         )
+        # Batches are independent, so with `num_parallel_requests` set the
+        # round trips of up to that many batches overlap. Threads share the
+        # authenticated session and its connection pool rather than each
+        # logging in separately.
+        batched_idxs = self._batch_indices(idxs)
+        if self.num_parallel_requests and len(batched_idxs) > 1:
+            with ThreadPoolExecutor(max_workers=self.num_parallel_requests) as executor:
+                data = list(chain.from_iterable(executor.map(_search, batched_idxs)))
+        else:
+            data = list(chain.from_iterable(map(_search, batched_idxs)))
+
         if subset:
-            for i in range(len(data)):
-                data[i]["subset"] = subset
+            for doc in data:
+                doc["subset"] = subset.value
 
         if self.use_document_model:
-            data = [IcsdPropertyDoc(**props) for props in data]
+            if self.trust_server:
+                # Skip validation of the data returned by the ICSD
+                data = [IcsdPropertyDoc.from_trusted(doc) for doc in data]
+            else:
+                data = _DOC_LIST_ADAPTER.validate_python(data)
         return data
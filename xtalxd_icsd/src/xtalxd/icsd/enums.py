@@ -1,15 +1,15 @@
 """Define ICSD-specific enums."""
 
-from enum import Enum
+from enum import StrEnum
 
 
-class IcsdSubset(Enum):
+class IcsdSubset(StrEnum):
     EXPERIMENTAL_INORGANIC = "experimental_inorganic"
     EXPERIMENTAL_METALORGANIC = "experimental_metalorganic"
     THERORETICAL_STRUCTURES = "theoretical"
 
 
-class IcsdAdvancedSearchKeys(Enum):
+class IcsdAdvancedSearchKeys(StrEnum):
 
     AUTHORS = "authors"
     ARTICLE = "article"
@@ -59,7 +59,7 @@ class IcsdAdvancedSearchKeys(Enum):
     POLARAXIS = "polaraxis"
 
 
-class IcsdDataFields(Enum):
+class IcsdDataFields(StrEnum):
 
     CollectionCode = "collection_code"
     CcdcNo = "ccdc_no"
@@ -2,7 +2,8 @@
 
 from __future__ import annotations
 
-from typing import TYPE_CHECKING
+import re
+from typing import TYPE_CHECKING, get_args
 
 from pydantic import BaseModel, Field, model_validator, ConfigDict
 from uncertainties import ufloat_fromstr
@@ -10,7 +11,14 @@ from uncertainties import ufloat_fromstr
 from xtalxd.icsd.enums import IcsdSubset
 
 if TYPE_CHECKING:
+    from collections.abc import Callable
     from typing import Any
+    from typing_extensions import Self
+
+_LATTICE_PARAMETERS = ("a", "b", "c", "alpha", "beta", "gamma")
+
+# Numbers with an uncertainty in the last digits, e.g. 5.4310(2)
+_UFLOAT_RE = re.compile(r"^[-+]?\d*(?:\.(\d*))?\((\d+)\)$")
 
 
 class UFloat(BaseModel):
@@ -21,7 +29,14 @@ class UFloat(BaseModel):
     @classmethod
     def parse_uncert(cls, config: Any) -> Any:
         if isinstance(config, str):
-            if "(" in config:
+            if match := _UFLOAT_RE.match(config):
+                decimals, uncertainty = match.groups()
+                config = {
+                    "value": float(config[: match.start(2) - 1]),
+                    "uncertainty": float(uncertainty) / 10 ** len(decimals or ""),
+                }
+            elif "(" in config:
+                # Less common formats, e.g. with exponents
                 parsed = ufloat_fromstr(config)
                 config = {"value": parsed.n, "uncertainty": parsed.s}
             else:
@@ -45,10 +60,20 @@ class CellParameters(BaseModel):
     @classmethod
     def from_str(cls, config):
         """Parse space-separated lattice parameters."""
-        lps = ["a", "b", "c", "alpha", "beta", "gamma"]
         if isinstance(config, str):
             vals = config.split()
-            config = {lp: vals[i] for i, lp in enumerate(lps)}
+            if len(vals) < len(_LATTICE_PARAMETERS):
+                raise ValueError(f"Expected six lattice parameters, got {config!r}")
+            if "(" not in config:
+                # No uncertainties, usually the case for all six or none of them
+                try:
+                    return {
+                        lp: {"value": float(val)}
+                        for lp, val in zip(_LATTICE_PARAMETERS, vals)
+                    }
+                except ValueError:
+                    pass
+            config = dict(zip(_LATTICE_PARAMETERS, vals))
         return config
 
 
@@ -128,7 +153,50 @@ class IcsdPropertyDoc(BaseModel):
     def deserialize(cls, config):
         if isinstance(config.get("authors"), str):
             config["authors"] = config["authors"].split(";")
-        for k, v in config.items():
-            if isinstance(v, str) and len(v) == 0:
-                config[k] = None
-        return config
+        return {
+            k: None if isinstance(v, str) and not v else v for k, v in config.items()
+        }
+
+    @classmethod
+    def from_trusted(cls, config: dict[str, Any]) -> Self:
+        """Build a document from ICSD data without running validation.
+
+        Only the fields which are not strings are converted, so this
+        should only be used with data in the format returned by the ICSD.
+        """
+        # Invariant: `config` holds only strings, as parsed from the ICSD CSV,
+        # plus the `cif` and `subset` added by the client. Anything else
+        # must go through the validated constructor.
+        if isinstance(config.get("authors"), str):
+            config["authors"] = config["authors"].split(";")
+        config = {k: None if v == "" else v for k, v in config.items()}
+        for k, parser in _TRUSTED_FIELD_PARSERS.items():
+            if config.get(k) is not None:
+                config[k] = parser(config[k])
+        if config.get("subset") is not None:
+            config["subset"] = IcsdSubset(config["subset"]).value
+        return cls.model_construct(**config)
+
+
+def _trusted_ufloat(value: str) -> UFloat:
+    return UFloat.model_construct(**UFloat.parse_uncert(value))
+
+
+def _trusted_cell_parameters(value: str) -> CellParameters:
+    return CellParameters.model_construct(
+        **{lp: _trusted_ufloat(v) for lp, v in CellParameters.from_str(value).items()}
+    )
+
+
+# Converters from strings for each non-string field of IcsdPropertyDoc
+_TRUSTED_FIELD_PARSERS: dict[str, Callable[[str], Any]] = {
+    name: parser
+    for name, field in IcsdPropertyDoc.model_fields.items()
+    for typ, parser in (
+        (int, int),
+        (float, float),
+        (UFloat, _trusted_ufloat),
+        (CellParameters, _trusted_cell_parameters),
+    )
+    if get_args(field.annotation)[:1] == (typ,)
+}
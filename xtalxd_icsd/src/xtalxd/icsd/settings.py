@@ -25,4 +25,12 @@ class IcsdClientSettings(BaseSettings):
         ),
     )
 
+    CACHE_DIR: str | None = Field(
+        None,
+        description=(
+            "If set, the directory in which to cache ICSD responses. "
+            "Repeated requests for the same entries are then read from disk."
+        ),
+    )
+
     model_config = SettingsConfigDict(env_prefix="ICSD_CLIENT_")
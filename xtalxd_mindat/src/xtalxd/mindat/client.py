@@ -1,28 +1,73 @@
 """Tools for querying the mindat api, see https://www.mindat.org/ for details."""
 
-from functools import partial, cached_property
-import multiprocessing
-from pydantic import BaseModel, Field, PrivateAttr
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property, partial
+import logging
+import orjson
+from pydantic import BaseModel, ConfigDict, Field, PrivateAttr
 import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
-from urllib.parse import urljoin
-from typing import Any
+from urllib.parse import parse_qs, urlencode, urljoin, urlsplit, urlunsplit
+from typing import Any, Iterable
 
 
 from xtalxd.mindat.settings import MindatClientSettings
 
 SETTINGS = MindatClientSettings()
 
+logger = logging.getLogger("xtalxd_mindat")
+
+# The list of endpoints is static, so it is shared by all clients
+# with the same API key and URL
+_ENDPOINTS_CACHE: dict[tuple[str | None, str], dict[str, str]] = {}
+
+# Distinguishes missing fields from fields with falsy values
+_MISSING = object()
+
+
+def _get_adapter(max_retries: int, pool_maxsize: int) -> HTTPAdapter:
+    """Get an adapter for one client's session.
+
+    The adapter's connection pools are thread-safe, so it is shared by
+    all threads using that session. It is not shared between clients,
+    as closing a session closes its adapter's pools.
+    """
+    retry = Retry(
+        total=max_retries,
+        read=max_retries,
+        connect=max_retries,
+        respect_retry_after_header=True,
+        allowed_methods=["GET"],
+        status_forcelist=[429, 504, 502],  # rate limiting
+        backoff_factor=0.1,
+    )
+    return HTTPAdapter(max_retries=retry, pool_maxsize=pool_maxsize)
+
+
+def _update_query(url: str, **params: Any) -> str:
+    """Set query parameters of a URL, keeping any others."""
+    split_url = urlsplit(url)
+    query = {**parse_qs(split_url.query), **params}
+    return urlunsplit(split_url._replace(query=urlencode(query, doseq=True)))
+
 
 class MindatClient(BaseModel):
 
+    # The session and headers are built from the fields, which
+    # should not change after them
+    model_config = ConfigDict(frozen=True)
+
     api_key: str = Field(SETTINGS.API_KEY)
     max_retries: int = Field(SETTINGS.MAX_RETRIES)
+    timeout: float | None = Field(SETTINGS.TIMEOUT)
+    pool_maxsize: int = Field(SETTINGS.POOL_MAXSIZE)
+    cache_name: str | None = Field(SETTINGS.CACHE_NAME)
+    cache_expire_after: float = Field(SETTINGS.CACHE_EXPIRE_AFTER)
     _url: str = PrivateAttr(SETTINGS.API_ENDPOINT)
     _session: requests.Session | None = PrivateAttr(None)
 
-    @property
+    @cached_property
     def headers(self) -> dict[str, str]:
         return {"Authorization": f"Token {self.api_key}"}
 
@@ -41,60 +86,97 @@ class MindatClient(BaseModel):
         self.session.close()
 
     def _get_session(self) -> requests.Session:
-        session = requests.Session()
-        session.headers = {"Authorization": f"Token {self.api_key}"}
-        retry = Retry(
-            total=self.max_retries,
-            read=self.max_retries,
-            connect=self.max_retries,
-            respect_retry_after_header=True,
-            status_forcelist=[429, 504, 502],  # rate limiting
-            backoff_factor=0.1,
-        )
-        adapter = HTTPAdapter(max_retries=retry)
+        if self.cache_name:
+            try:
+                import requests_cache
+            except ImportError as exc:
+                raise ImportError(
+                    "Caching Mindat responses requires requests-cache, "
+                    "install it with `pip install xtalxd.mindat[cache]`."
+                ) from exc
+
+            session = requests_cache.CachedSession(
+                self.cache_name,
+                backend="sqlite",
+                expire_after=self.cache_expire_after,
+                allowable_methods=("GET",),
+                allowable_codes=(200,),
+            )
+        else:
+            session = requests.Session()
+        session.headers.update({**self.headers, "Accept": "application/json"})
+        adapter = _get_adapter(self.max_retries, self.pool_maxsize)
         session.mount("http://", adapter)
         session.mount("https://", adapter)
         return session
 
     def _get(self, url):
-        return self.session.get(url).json()
+        response = self.session.get(url, timeout=self.timeout)
+        response.raise_for_status()
+        return orjson.loads(response.content)
 
     def get_mindat_endpoints(self):
         """Get a list of possible endpoints to search through.
 
         An endpoint is basically a different collection of data.
         """
-        return self._get(urljoin(self._url, "v1"))
+        key = (self.api_key, self._url)
+        if (endpoints := _ENDPOINTS_CACHE.get(key)) is None:
+            endpoints = _ENDPOINTS_CACHE[key] = self._get(urljoin(self._url, "v1"))
+        return endpoints
 
     @cached_property
     def _valid_endpoints(self) -> set[str]:
         return set(self.get_mindat_endpoints())
 
+    @staticmethod
+    def _get_page_urls(decoded: dict[str, Any]) -> list[str] | None:
+        """Get the URLs of all remaining pages from the response for one page.
+
+        Returns None if they cannot be computed from the total count and
+        page number, in which case the pages have to be walked in order.
+        """
+        if not (next_url := decoded.get("next")):
+            return []
+        count = decoded.get("count")
+        page_size = len(decoded.get("results") or [])
+        if not count or not page_size:
+            return None
+
+        try:
+            next_page = int(parse_qs(urlsplit(next_url).query)["page"][0])
+        except (KeyError, ValueError):
+            return None
+
+        num_pages = -(-count // page_size)
+        return [
+            _update_query(next_url, page=page)
+            for page in range(next_page, num_pages + 1)
+        ]
+
+    @staticmethod
+    def _select_fields(
+        decoded: dict[str, Any], fields: list[str] | None = None
+    ) -> Iterable[dict[str, Any]]:
+        if fields:
+            return (
+                {k: v for k in fields if (v := entry.get(k, _MISSING)) is not _MISSING}
+                for entry in decoded["results"]
+            )
+        return decoded["results"]
+
     def _get_fields_from_response(
         self,
         url: str,
         fields: list[str] | None = None,
     ) -> tuple[str, list[dict[str, Any]]] | tuple[None, list]:
-        next_url = None
-        data = []
-        for itry in range(self.max_retries):
-            try:
-                decoded = self._get(url)
-                if fields:
-                    data += [
-                        {k: entry.get(k) for k in fields if entry.get(k)}
-                        for entry in decoded["results"]
-                    ]
-                else:
-                    data += decoded["results"]
-                next_url = decoded["next"]
-                break
-
-            except Exception as exc:
-                print(
-                    f"Query failed with exception (try {itry}/{self.max_retries}):\n{exc}"
-                )
-        return next_url, data
+        # Transient errors are already retried by the session's adapter
+        try:
+            decoded = self._get(url)
+            return decoded.get("next"), list(self._select_fields(decoded, fields))
+        except (requests.RequestException, KeyError, ValueError) as exc:
+            logger.warning("Query of %s failed with exception: %s", url, exc)
+        return None, []
 
     def get_mindat_data_by_endpoint(
         self,
@@ -119,25 +201,55 @@ class MindatClient(BaseModel):
         #     )
 
         next_url = self.get_mindat_endpoints()[endpoint]
+        if fields:
+            # Only have the API send the requested fields, subsequent
+            # page URLs keep this parameter
+            next_url = _update_query(next_url, fields=",".join(fields))
         if parallel_requests > 1 and paginate:
-            urls = {next_url}
-            while next_url:
-                try:
-                    decoded = self._get(next_url)
+            # The total count and page size give the URL of every page,
+            # only walk through the pages if these are missing
+            try:
+                first_page = self._get(next_url)
+                data = list(self._select_fields(first_page, fields))
+            except (requests.RequestException, KeyError, ValueError) as exc:
+                # As in the serial case, a failed first page gives no results
+                logger.warning("Query of %s failed with exception: %s", next_url, exc)
+                return []
+            urls = self._get_page_urls(first_page)
+            if urls is None:
+                # Each page can only be found from the one before it, so
+                # keep the results of walking through them instead of
+                # fetching every page a second time
+                urls = []
+                next_url = first_page.get("next")
+                get, max_retries = self._get, self.max_retries
+                num_failures = 0
+                while next_url and num_failures < max_retries:
+                    try:
+                        decoded = get(next_url)
+                        data.extend(self._select_fields(decoded, fields))
+                    except (requests.RequestException, KeyError, ValueError) as exc:
+                        num_failures += 1
+                        logger.warning(
+                            "Query of %s failed with exception: %s", next_url, exc
+                        )
+                        continue
                     next_url = decoded.get("next")
-                    if next_url:
-                        urls.add(next_url)
-                except Exception:
-                    continue
 
             _get = partial(self._get_fields_from_response, fields=fields)
-            with multiprocessing.Pool(parallel_requests) as pool:
-                _outputs = pool.map(_get, list(urls))
-            return [entry for outputs in _outputs for entry in outputs[1]]
+            # Requests are I/O-bound, and threads share the session's connections
+            with ThreadPoolExecutor(max_workers=parallel_requests) as executor:
+                # executor.map yields pages in the order they were submitted,
+                # so a slow page holds back the pages after it, which keeps
+                # the results in page order
+                for _, page_data in executor.map(_get, urls):
+                    data.extend(page_data)
+            return data
 
         data = []
+        get_fields_from_response = self._get_fields_from_response
         while next_url:
-            next_url, new_data = self._get_fields_from_response(next_url, fields=fields)
+            next_url, new_data = get_fields_from_response(next_url, fields=fields)
             data.extend(new_data)
             if not paginate:
                 next_url = None
@@ -28,4 +28,24 @@ class MindatClientSettings(BaseSettings):
         ),
     )
 
+    POOL_MAXSIZE: int = Field(
+        32,
+        description=(
+            "The maximum number of connections to keep open to the API, "
+            "this should be at least the number of parallel requests."
+        ),
+    )
+
+    CACHE_NAME: str | None = Field(
+        None,
+        description=(
+            "If set, the name of an on-disk cache of API responses, which "
+            "requires the requests-cache package."
+        ),
+    )
+
+    CACHE_EXPIRE_AFTER: float = Field(
+        86400.0, description="The time in seconds for which responses are cached."
+    )
+
     model_config = SettingsConfigDict(env_prefix="MINDAT_")